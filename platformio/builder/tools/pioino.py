@@ -13,10 +13,14 @@
 # limitations under the License.
 
 import atexit
+import functools
 import glob
 import io
+import itertools
 import os
 import re
+import subprocess
+import sys
 import tempfile
 
 import click
@@ -24,19 +28,44 @@ import click
 from platformio.compat import get_filesystem_encoding, get_locale_encoding
 
 
-class InoToCPPConverter:
-    PROTOTYPE_RE = re.compile(
+def _compile_prototype_re():
+    # possessive quantifiers keep matching time linear on long declarations,
+    # they are supported by the optional "regex" module and by "re" since 3.11
+    engine = re
+    possessive = "+" if sys.version_info >= (3, 11) else ""
+    try:
+        # "regex" is not a PlatformIO dependency, it is used only when it
+        # happens to be installed in the interpreter that runs SCons
+        import regex as engine  # pylint: disable=import-outside-toplevel
+
+        possessive = "+"
+    except ImportError:
+        pass
+    return engine.compile(
         r"""^(
-        (?:template\<.*\>\s*)?      # template
-        ([a-z_\d\&]+\*?\s+){1,2}    # return type
-        ([a-z_\d]+\s*)              # name of prototype
-        \([a-z_,\.\*\&\[\]\s\d]*\)  # arguments
-        )\s*(\{|;)                  # must end with `{` or `;`
-        """,
-        re.X | re.M | re.I,
+        (?:template\<.*\>\s*)?              # template
+        ([a-z_\d\&]+%(p)s\*?\s+%(p)s){1,2}  # return type
+        ([a-z_\d]+%(p)s\s*%(p)s)            # name of prototype
+        \([a-z_,\.\*\&\[\]\s\d]*%(p)s\)     # arguments
+        )\s*(\{|;)                          # must end with `{` or `;`
+        """
+        % dict(p=possessive),
+        engine.X | engine.M | engine.I,
     )
+
+
+class InoToCPPConverter:
+    PROTOTYPE_RE = _compile_prototype_re()
     DETECTMAIN_RE = re.compile(r"void\s+(setup|loop)\s*\(", re.M | re.I)
+    RESERVED_KEYWORDS = frozenset(("if", "else", "while"))
     PROTOPTRS_TPLRE = r"\([^&\(]*&(%s)[^\)]*\)"
+    MULTILINE_STR_RE = re.compile(
+        r"""^("[^\n]*)\\\n          # opening line of a string
+        ((?:(?!")[^\n]*\\\n)*)      # continuation lines
+        ([^\n]*"[,;])$              # closing line, ends with `",` or `";`
+        """,
+        re.X | re.M,
+    )
 
     def __init__(self, env):
         self.env = env
@@ -86,79 +115,106 @@ class InoToCPPConverter:
 
     def merge(self, nodes):
         assert nodes
-        lines = []
+        main_parts = []
+        other_parts = []
+        is_main_node = self.is_main_node
         for node in nodes:
-            contents = self.read_safe_contents(node.get_path())
-            _lines = ['# 1 "%s"' % node.get_path().replace("\\", "/"), contents]
-            if self.is_main_node(contents):
-                lines = _lines + lines
-                self._main_ino = node.get_path()
+            path = node.get_path()
+            contents = self.read_safe_contents(path)
+            part = ('# 1 "%s"' % path.replace("\\", "/"), contents)
+            if is_main_node(contents):
+                main_parts.append(part)
+                self._main_ino = path
             else:
-                lines.extend(_lines)
+                other_parts.append(part)
 
         if not self._main_ino:
             self._main_ino = nodes[0].get_path()
 
-        return "\n".join(["#include <Arduino.h>"] + lines) if lines else None
+        if not main_parts and not other_parts:
+            return None
+        # the last detected main node goes first
+        return "\n".join(
+            itertools.chain(
+                ["#include <Arduino.h>"],
+                itertools.chain.from_iterable(reversed(main_parts)),
+                itertools.chain.from_iterable(other_parts),
+            )
+        )
 
     def process(self, contents):
         out_file = re.sub(r"[\"\'\;]+", "", self._main_ino) + ".cpp"
-        assert self._gcc_preprocess(contents, out_file)
-        contents = self.read_safe_contents(out_file)
-        contents = self._join_multiline_strings(contents)
+        # the preprocessor is only needed to strip comments and line continuations
+        if any(s in contents for s in ("\\\n", "/*", "//")):
+            contents = self._gcc_preprocess(contents, out_file)
+            assert contents is not None
+            contents = self._join_multiline_strings(contents)
         self.write_safe_contents(out_file, self.append_prototypes(contents))
         return out_file
 
     def _gcc_preprocess(self, contents, out_file):
-        tmp_path = tempfile.mkstemp()[1]
-        self.write_safe_contents(tmp_path, contents)
-        self.env.Execute(
-            self.env.VerboseAction(
-                '$CXX -o "{0}" -x c++ -fpreprocessed -dD -E "{1}"'.format(
-                    out_file, tmp_path
-                ),
-                "Converting " + os.path.basename(out_file[:-4]),
-            )
+        with tempfile.NamedTemporaryFile(
+            "w", encoding=self._safe_encoding, errors="backslashreplace", delete=False
+        ) as fp:
+            fp.write(contents)
+            tmp_path = fp.name
+        # pylint: disable=import-error,import-outside-toplevel
+        from SCons.Script import ARGUMENTS
+
+        cmd = self.env.subst('$CXX -x c++ -fpreprocessed -dD -E "{0}"'.format(tmp_path))
+        click.echo(
+            cmd
+            if int(ARGUMENTS.get("PIOVERBOSE", 0))
+            else "Converting " + os.path.basename(out_file[:-4])
         )
-        atexit.register(_delete_file, tmp_path)
-        return os.path.isfile(out_file)
+        sysenv = os.environ.copy()
+        sysenv["PATH"] = str(self.env["ENV"]["PATH"])
+        try:
+            with subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                env=sysenv,
+                shell=True,
+                encoding=self._safe_encoding or get_locale_encoding(),
+                errors="replace",
+            ) as p:
+                output = p.communicate()[0]
+        finally:
+            _delete_file(tmp_path)
+        return output if p.returncode == 0 else None
 
     def _join_multiline_strings(self, contents):
         if "\\\n" not in contents:
             return contents
-        newlines = []
-        linenum = 0
-        stropen = False
-        for line in contents.split("\n"):
-            _linenum = self._parse_preproc_line_num(line)
-            if _linenum is not None:
-                linenum = _linenum
-            else:
-                linenum += 1
-
-            if line.endswith("\\"):
-                if line.startswith('"'):
-                    stropen = True
-                    newlines.append(line[:-1])
-                    continue
-                if stropen:
-                    newlines[len(newlines) - 1] += line[:-1]
-                    continue
-            elif stropen and line.endswith(('",', '";')):
-                newlines[len(newlines) - 1] += line
-                stropen = False
-                newlines.append(
-                    '#line %d "%s"' % (linenum, self._main_ino.replace("\\", "/"))
-                )
-                continue
+        linenums = self._get_line_nums(contents.split("\n"))
+        cursor = [0, 0]  # [position, line index] of the previous match
+
+        def _replace(match):
+            cursor[1] += contents.count("\n", cursor[0], match.end())
+            cursor[0] = match.end()
+            return '%s%s%s\n#line %d "%s"' % (
+                match.group(1),
+                match.group(2).replace("\\\n", ""),
+                match.group(3),
+                linenums[cursor[1]],
+                self._main_ino.replace("\\", "/"),
+            )
 
-            newlines.append(line)
+        return self.MULTILINE_STR_RE.sub(_replace, contents)
 
-        return "\n".join(newlines)
+    @classmethod
+    def _get_line_nums(cls, lines):
+        result = []
+        linenum = 0
+        for line in lines:
+            _linenum = cls._parse_preproc_line_num(line)
+            linenum = linenum + 1 if _linenum is None else _linenum
+            result.append(linenum)
+        return result
 
     @staticmethod
     def _parse_preproc_line_num(line):
-        if not line.startswith("#"):
+        if line[:1] != "#":
             return None
         tokens = line.split(" ", 3)
         if len(tokens) > 2 and tokens[1].isdigit():
@@ -167,11 +223,12 @@ class InoToCPPConverter:
 
     def _parse_prototypes(self, contents):
         prototypes = []
-        reserved_keywords = set(["if", "else", "while"])
-        for match in self.PROTOTYPE_RE.finditer(contents):
+        reserved_keywords = self.RESERVED_KEYWORDS
+        finditer = self.PROTOTYPE_RE.finditer
+        for match in finditer(contents):
             if (
-                set([match.group(2).strip(), match.group(3).strip()])
-                & reserved_keywords
+                match.group(2).strip() in reserved_keywords
+                or match.group(3).strip() in reserved_keywords
             ):
                 continue
             prototypes.append(match)
@@ -179,14 +236,17 @@ class InoToCPPConverter:
 
     def _get_total_lines(self, contents):
         total = 0
-        if contents.endswith("\n"):
-            contents = contents[:-1]
-        for line in contents.split("\n")[::-1]:
-            linenum = self._parse_preproc_line_num(line)
+        end = len(contents) - 1 if contents.endswith("\n") else len(contents)
+        # walk lines backward up to the nearest line marker
+        while True:
+            start = contents.rfind("\n", 0, end)
+            linenum = self._parse_preproc_line_num(contents[start + 1 : end])
             if linenum is not None:
                 return total + linenum
             total += 1
-        return total
+            if start < 0:
+                return total
+            end = start
 
     def append_prototypes(self, contents):
         prototypes = self._parse_prototypes(contents) or []
@@ -198,13 +258,14 @@ class InoToCPPConverter:
         if not prototypes:
             return contents
 
-        prototype_names = set(m.group(3).strip() for m in prototypes)
         split_pos = prototypes[0].start()
-        match_ptrs = re.search(
-            self.PROTOPTRS_TPLRE % ("|".join(prototype_names)),
-            contents[:split_pos],
-            re.M,
-        )
+        # pointers to the functions are only possible after the `&` operator
+        match_ptrs = None
+        if contents.find("&", 0, split_pos) != -1:
+            prototype_names = set(m.group(3).strip() for m in prototypes)
+            match_ptrs = _compile_protoptrs(tuple(sorted(prototype_names))).search(
+                contents, 0, split_pos
+            )
         if match_ptrs:
             split_pos = contents.rfind("\n", 0, match_ptrs.start()) + 1
 
@@ -222,6 +283,11 @@ class InoToCPPConverter:
         return "\n".join(result)
 
 
+@functools.lru_cache(maxsize=128)
+def _compile_protoptrs(names):
+    return re.compile(InoToCPPConverter.PROTOPTRS_TPLRE % "|".join(names), re.M)
+
+
 def FindInoNodes(env):
     src_dir = glob.escape(env.subst("$PROJECT_SRC_DIR"))
     return env.Glob(os.path.join(src_dir, "*.ino")) + env.Glob(
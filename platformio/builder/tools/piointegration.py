@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import glob
+import fnmatch
 import os
 
 import SCons.Defaults  # pylint: disable=import-error
@@ -26,12 +26,45 @@ def IsIntegrationDump(_):
     return set(["__idedata", "idedata"]) & set(COMMAND_LINE_TARGETS)
 
 
+def _get_subst_func(env):
+    # identical items are common, e.g. flags pulled by transitive dependencies
+    cache = {}
+
+    def _subst(item):
+        if item not in cache:
+            cache[item] = env.subst(item)
+        return cache[item]
+
+    return _subst
+
+
+def _scan_dirs(paths, *patterns):
+    # walk one level per pattern, cheaper than `glob` for toolchain trees
+    for pattern in patterns:
+        matched = []
+        for path in paths:
+            try:
+                with os.scandir(path) as it:
+                    matched.extend(
+                        entry.path
+                        for entry in it
+                        if not entry.name.startswith(".")
+                        and fnmatch.fnmatch(entry.name, pattern)
+                        and entry.is_dir()
+                    )
+            except OSError:
+                continue
+        paths = matched
+    return paths
+
+
 def DumpIntegrationIncludes(env):
     result = dict(build=[], compatlib=[], toolchain=[])
+    subst = _get_subst_func(env)
 
     # `env`(project) CPPPATH
     result["build"].extend(
-        [os.path.abspath(env.subst(item)) for item in env.get("CPPPATH", [])]
+        [os.path.abspath(subst(item)) for item in env.get("CPPPATH", [])]
     )
 
     # installed libs
@@ -45,15 +78,15 @@ def DumpIntegrationIncludes(env):
     for pkg in p.get_installed_packages(with_optional=False):
         if p.get_package_type(pkg.metadata.name) != "toolchain":
             continue
-        toolchain_dir = glob.escape(pkg.path)
-        toolchain_incglobs = [
-            os.path.join(toolchain_dir, "*", "include", "c++", "*"),
-            os.path.join(toolchain_dir, "*", "include", "c++", "*", "*-*-*"),
-            os.path.join(toolchain_dir, "lib", "gcc", "*", "*", "include*"),
-            os.path.join(toolchain_dir, "*", "include*"),
-        ]
-        for g in toolchain_incglobs:
-            result["toolchain"].extend([os.path.abspath(inc) for inc in glob.glob(g)])
+        top_dirs = _scan_dirs([pkg.path], "*")
+        cxx_dirs = _scan_dirs(top_dirs, "include", "c++", "*")
+        for items in (
+            cxx_dirs,
+            _scan_dirs(cxx_dirs, "*-*-*"),
+            _scan_dirs([pkg.path], "lib", "gcc", "*", "*", "include*"),
+            _scan_dirs(top_dirs, "include*"),
+        ):
+            result["toolchain"].extend([os.path.abspath(inc) for inc in items])
 
     return result
 
@@ -83,11 +116,12 @@ def get_gcc_defines(env):
 
 def dump_defines(env):
     defines = []
+    subst = _get_subst_func(env)
     # global symbols
     for item in SCons.Defaults.processDefines(env.get("CPPDEFINES", [])):
         item = item.strip()
         if item:
-            defines.append(env.subst(item).replace('\\"', '"'))
+            defines.append(subst(item).replace('\\"', '"'))
 
     # special symbol for Atmel AVR MCU
     if env["PIOPLATFORM"] == "atmelavr":
@@ -140,6 +174,7 @@ def _split_flags_string(env, s):
 
 def DumpIntegrationData(*args):
     projenv, globalenv = args[0:2]  # pylint: disable=unbalanced-tuple-unpacking
+    envpath = globalenv.subst("${ENV['PATH']}")
     data = {
         "build_type": globalenv.GetBuildType(),
         "env_name": globalenv["PIOENV"],
@@ -150,15 +185,9 @@ def DumpIntegrationData(*args):
         "includes": projenv.DumpIntegrationIncludes(),
         "cc_flags": _split_flags_string(projenv, "$CFLAGS $CCFLAGS $CPPFLAGS"),
         "cxx_flags": _split_flags_string(projenv, "$CXXFLAGS $CCFLAGS $CPPFLAGS"),
-        "cc_path": where_is_program(
-            globalenv.subst("$CC"), globalenv.subst("${ENV['PATH']}")
-        ),
-        "cxx_path": where_is_program(
-            globalenv.subst("$CXX"), globalenv.subst("${ENV['PATH']}")
-        ),
-        "gdb_path": where_is_program(
-            globalenv.subst("$GDB"), globalenv.subst("${ENV['PATH']}")
-        ),
+        "cc_path": where_is_program(globalenv.subst("$CC"), envpath),
+        "cxx_path": where_is_program(globalenv.subst("$CXX"), envpath),
+        "gdb_path": where_is_program(globalenv.subst("$GDB"), envpath),
         "prog_path": globalenv.subst("$PROGPATH"),
         "svd_path": dump_svd_path(globalenv),
         "compiler_type": globalenv.GetCompilerType(),
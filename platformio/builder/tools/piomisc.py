@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import re
 import sys
 
 from platformio import fs, util
@@ -22,9 +23,13 @@ from platformio.proc import exec_command
 @util.memoized()
 def GetCompilerType(env):  # pylint: disable=too-many-return-statements
     CC = env.subst("$CC")
-    if CC.endswith("-gcc"):
+    cc_name = os.path.basename(CC).lower()
+    if cc_name.endswith(".exe"):
+        cc_name = cc_name[:-4]
+    if cc_name.endswith("-gcc"):
         return "gcc"
-    if os.path.basename(CC) == "clang":
+    # a bare "gcc" or "cc" may be Apple clang, let "-v" decide
+    if re.match(r"^clang(-\d+)?$", cc_name):
         return "clang"
     try:
 
@@ -44,9 +49,13 @@ def GetCompilerType(env):  # pylint: disable=too-many-return-statements
 
 
 def GetActualLDScript(env):
+    libpaths = []
+
     def _lookup_in_ldpath(script):
-        for d in env.get("LIBPATH", []):
-            path = os.path.join(env.subst(d), script)
+        if not libpaths:
+            libpaths.extend(env.subst(d) for d in env.get("LIBPATH", []))
+        for d in libpaths:
+            path = os.path.join(d, script)
             if os.path.isfile(path):
                 return path
         return None
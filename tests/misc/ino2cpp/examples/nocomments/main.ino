@@ -0,0 +1,15 @@
+int   counter  =   0;
+
+void setup() {
+  pinMode(13, OUTPUT);
+}
+
+void loop() {
+  counter = helper(counter);
+  digitalWrite(13, counter % 2);
+#warning "Line 10"
+}
+
+int helper(int   x) {
+  return x + 1;
+}
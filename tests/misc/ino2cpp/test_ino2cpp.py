@@ -15,6 +15,7 @@
 from os import listdir
 from os.path import dirname, isdir, join, normpath
 
+from platformio.builder.tools.pioino import InoToCPPConverter
 from platformio.commands.ci import cli as cmd_ci
 
 EXAMPLES_DIR = normpath(join(dirname(__file__), "examples"))
@@ -46,3 +47,51 @@ def test_warning_line(clirunner, validate_cliresult):
     )
     validate_cliresult(result)
     assert 'main.ino:75:2: warning: #warning "Line 75"' in result.output
+    # sketch without comments and line continuations skips the preprocessor
+    result = clirunner.invoke(cmd_ci, [join(EXAMPLES_DIR, "nocomments"), "-b", "uno"])
+    validate_cliresult(result)
+    assert 'main.ino:10:2: warning: #warning "Line 10"' in result.output
+
+
+def test_join_multiline_strings():
+    converter = InoToCPPConverter(None)
+    converter._main_ino = "/project/main.ino"  # pylint: disable=protected-access
+    contents = "\n".join(
+        [
+            '# 1 "/project/main.ino"',
+            "const char a[] =",
+            '"foo\\',
+            "bar\\",
+            'baz";',
+            "int x;",
+            '# 10 "/project/main.ino"',
+            "const char *b =",
+            '"q\\',
+            'r", *c = "1";',
+            "int y;",
+        ]
+    )
+    # pylint: disable=protected-access
+    assert converter._join_multiline_strings(contents) == "\n".join(
+        [
+            '# 1 "/project/main.ino"',
+            "const char a[] =",
+            '"foobarbaz";',
+            '#line 5 "/project/main.ino"',
+            "int x;",
+            '# 10 "/project/main.ino"',
+            "const char *b =",
+            '"qr", *c = "1";',
+            '#line 13 "/project/main.ino"',
+            "int y;",
+        ]
+    )
+
+
+def test_get_total_lines():
+    converter = InoToCPPConverter(None)
+    # pylint: disable=protected-access
+    assert converter._get_total_lines("") == 1
+    assert converter._get_total_lines("a\nb\n") == 2
+    assert converter._get_total_lines('# 7 "main.ino"') == 7
+    assert converter._get_total_lines('a\n# 7 "main.ino"\nb\nc\n') == 9